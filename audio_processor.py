@@ -3,12 +3,15 @@
 PyDubまたはffmpegを使用して100MB以上のファイルを処理
 """
 import os
+import math
+import asyncio
 import tempfile
 import logging
-from typing import List
+from typing import List, Optional
 import shutil
 import subprocess
 import json
+import glob
 
 logger = logging.getLogger(__name__)
 
@@ -24,17 +27,49 @@ except (ImportError, ModuleNotFoundError) as e:
     AudioSegment = None
     mediainfo = None
 
+# NumPyによるベクトル化処理（モノラル化など）
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except (ImportError, ModuleNotFoundError):
+    NUMPY_AVAILABLE = False
+    np = None
+
+# 高速・高品質なリサンプリング（libsoxr）
+try:
+    import soxr
+    SOXR_AVAILABLE = NUMPY_AVAILABLE
+except (ImportError, ModuleNotFoundError):
+    SOXR_AVAILABLE = False
+    soxr = None
+
+def _mktemp(suffix: str = "") -> str:
+    """
+    一時ファイルを作成してパスを返す（tempfile.mktempの安全な代替）
+
+    Args:
+        suffix: ファイル名の接尾辞
+
+    Returns:
+        作成した一時ファイルのパス
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        return f.name
+
 # ffmpegの利用可能性をチェック
 def check_ffmpeg_available() -> tuple:
     """
-    ffmpegが利用可能かチェック
+    ffmpegが利用可能かチェック（サブプロセスは起動せず、存在確認のみ行う）
 
     Returns:
         (利用可能かどうか, ffmpegコマンドのパス)
     """
+    # PATH環境変数から探す
+    if shutil.which('ffmpeg'):
+        return (True, 'ffmpeg')
+
     # 一般的なインストール場所
     common_paths = [
-        'ffmpeg',  # PATH環境変数から
         'C:/ffmpeg-8.0.1-essentials_build/bin/ffmpeg.exe',
         'C:/ffmpeg/bin/ffmpeg.exe',
         'C:/Program Files/ffmpeg/bin/ffmpeg.exe',
@@ -42,17 +77,8 @@ def check_ffmpeg_available() -> tuple:
     ]
 
     for ffmpeg_path in common_paths:
-        try:
-            result = subprocess.run(
-                [ffmpeg_path, '-version'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                return (True, ffmpeg_path)
-        except (FileNotFoundError, subprocess.TimeoutExpired):
-            continue
+        if os.path.exists(ffmpeg_path):
+            return (True, ffmpeg_path)
 
     return (False, None)
 
@@ -66,8 +92,10 @@ class AudioProcessor:
     # 定数定義
     MAX_FILE_SIZE_MB = 100  # 100MB
     MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+    FFMPEG_DIRECT_SIZE_BYTES = 50 * 1024 * 1024  # これを超えるファイルはPyDubを介さずffmpegで処理
     SEGMENT_DURATION_MS = 60 * 60 * 1000  # 1時間（ミリ秒）
     TARGET_BITRATE = "64k"  # 圧縮後のビットレート
+    TARGET_BITRATE_BPS = 64 * 1000  # 圧縮後のビットレート（bps）
     TARGET_SAMPLE_RATE = 16000  # サンプリングレート（16kHz）
     
     def __init__(self):
@@ -88,6 +116,12 @@ class AudioProcessor:
             file_size = os.path.getsize(file_path)
             logger.info(f"入力ファイルサイズ: {file_size / (1024 * 1024):.2f} MB")
 
+            # 大きなファイルはPyDubでメモリ上に展開せず、ffmpegでストリーム処理する
+            if FFMPEG_AVAILABLE and file_size > self.FFMPEG_DIRECT_SIZE_BYTES:
+                logger.info("ffmpegを使用してファイルを圧縮・分割します")
+                # 分割方法は音声の長さから推定した圧縮後サイズで判定する
+                return self._split_audio_with_ffmpeg(file_path)
+
             # PyDubが使えない場合はffmpegを試す
             if not PYDUB_AVAILABLE:
                 # 100MB以上のファイルでffmpegが利用可能な場合
@@ -110,7 +144,7 @@ class AudioProcessor:
                 logger.warning("音声処理機能が無効のため、元のファイルをそのまま使用します")
                 # 一時コピーを作成
                 _, ext = os.path.splitext(file_path)
-                output_path = tempfile.mktemp(suffix=ext)
+                output_path = _mktemp(suffix=ext)
                 shutil.copy2(file_path, output_path)
                 self.temp_files.append(output_path)
                 return [output_path]
@@ -141,27 +175,22 @@ class AudioProcessor:
                 logger.info("音声ファイルを圧縮します")
                 audio = self._compress_audio(audio)
 
-                # 圧縮後のサイズを確認するため一時出力
-                temp_compressed = tempfile.mktemp(suffix=".mp3")
-                audio.export(temp_compressed, format="mp3", bitrate=self.TARGET_BITRATE)
-                compressed_size = os.path.getsize(temp_compressed)
-                logger.info(f"圧縮後サイズ: {compressed_size / (1024 * 1024):.2f} MB")
+                # 圧縮後のサイズを推定（CBRのため長さとビットレートから算出できる）
+                estimated_size = (len(audio) / 1000.0) * (self.TARGET_BITRATE_BPS / 8)
+                logger.info(f"圧縮後推定サイズ: {estimated_size / (1024 * 1024):.2f} MB")
 
                 # 圧縮後も100MBを超える場合は強制的に分割
-                if compressed_size > self.MAX_FILE_SIZE_BYTES:
-                    logger.warning(f"圧縮後も {compressed_size / (1024 * 1024):.2f} MB で100MBを超えています。ファイルサイズベースで分割します")
-                    os.unlink(temp_compressed)  # 一時ファイルを削除
+                if estimated_size > self.MAX_FILE_SIZE_BYTES:
+                    logger.warning(f"圧縮後も {estimated_size / (1024 * 1024):.2f} MB で100MBを超える見込みです。ファイルサイズベースで分割します")
                     return self._split_audio_by_size(audio)
 
-                os.unlink(temp_compressed)  # 一時ファイルを削除
-
             # 分割処理（時間ベース）
             if needs_split:
                 logger.info(f"音声ファイルを1時間ごとに分割します")
                 return self._split_audio(audio)
             else:
                 # 分割不要の場合は圧縮済みファイルを返す
-                output_path = tempfile.mktemp(suffix=".mp3")
+                output_path = _mktemp(suffix=".mp3")
                 audio.export(output_path, format="mp3", bitrate=self.TARGET_BITRATE)
                 output_size = os.path.getsize(output_path)
                 logger.info(f"処理完了 - 出力サイズ: {output_size / (1024 * 1024):.2f} MB")
@@ -185,15 +214,60 @@ class AudioProcessor:
         # モノラル化
         if audio.channels > 1:
             logger.info("ステレオからモノラルに変換")
-            audio = audio.set_channels(1)
+            if NUMPY_AVAILABLE and audio.sample_width == 2:
+                audio = self._downmix_with_numpy(audio)
+            else:
+                audio = audio.set_channels(1)
         
         # サンプリングレート変更
         if audio.frame_rate != self.TARGET_SAMPLE_RATE:
             logger.info(f"サンプリングレートを {audio.frame_rate}Hz から {self.TARGET_SAMPLE_RATE}Hz に変更")
-            audio = audio.set_frame_rate(self.TARGET_SAMPLE_RATE)
+            if SOXR_AVAILABLE and audio.channels == 1 and audio.sample_width == 2:
+                audio = self._resample_with_soxr(audio)
+            else:
+                audio = audio.set_frame_rate(self.TARGET_SAMPLE_RATE)
         
         return audio
     
+    def _downmix_with_numpy(self, audio: AudioSegment) -> AudioSegment:
+        """
+        NumPyで16bit音声をモノラルにダウンミックス
+
+        Args:
+            audio: ダウンミックス前の音声データ（16bit）
+
+        Returns:
+            モノラル化した音声データ
+        """
+        samples = np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, audio.channels)
+        # float64の中間配列を避けるため整数演算で平均を取る（int32の和は16bit値の加算でも溢れない）
+        mono = (samples.sum(axis=1, dtype=np.int32) // audio.channels).astype(np.int16)
+        return AudioSegment(
+            mono.tobytes(),
+            sample_width=2,
+            frame_rate=audio.frame_rate,
+            channels=1
+        )
+
+    def _resample_with_soxr(self, audio: AudioSegment) -> AudioSegment:
+        """
+        libsoxrでモノラル16bit音声をリサンプリング
+
+        Args:
+            audio: リサンプリング前の音声データ（モノラル、16bit）
+
+        Returns:
+            TARGET_SAMPLE_RATEにリサンプリングした音声データ
+        """
+        samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+        resampled = soxr.resample(samples, audio.frame_rate, self.TARGET_SAMPLE_RATE, quality='HQ')
+        return AudioSegment(
+            resampled.astype(np.int16).tobytes(),
+            sample_width=2,
+            frame_rate=self.TARGET_SAMPLE_RATE,
+            channels=1
+        )
+
     def _split_audio(self, audio: AudioSegment) -> List[str]:
         """
         音声ファイルを1時間ごとのセグメントに分割
@@ -208,10 +282,37 @@ class AudioProcessor:
         segment_paths = []
 
         # セグメント数を計算
-        num_segments = (total_duration // self.SEGMENT_DURATION_MS) + 1
+        num_segments = max(1, math.ceil(total_duration / self.SEGMENT_DURATION_MS))
         total_hours = total_duration / (1000 * 60 * 60)
         logger.info(f"音声を {num_segments} 個のセグメント（1時間ごと）に分割 - 合計長さ: {total_hours:.2f}時間")
 
+        # ffmpegが使える場合はWAVを1回だけ書き出し、segmentマルチプレクサで一括分割
+        if FFMPEG_AVAILABLE:
+            # プレフィックス用に作成したファイルもクリーンアップ対象にする
+            output_prefix = _mktemp()
+            self.temp_files.append(output_prefix)
+            temp_wav = output_prefix + ".wav"
+            try:
+                audio.export(temp_wav, format="wav")
+                return self._run_segment_muxer(
+                    temp_wav,
+                    self.SEGMENT_DURATION_MS // 1000,
+                    ['-c:a', 'libmp3lame', '-b:a', self.TARGET_BITRATE],
+                    output_prefix,
+                    timeout=300 * num_segments
+                )
+            except Exception:
+                # エラー時は作成したファイルをクリーンアップ
+                for path in glob.glob(output_prefix + '_segment_*.mp3'):
+                    try:
+                        os.unlink(path)
+                    except Exception:
+                        pass
+                raise
+            finally:
+                if os.path.exists(temp_wav):
+                    os.unlink(temp_wav)
+
         for i in range(num_segments):
             start_ms = i * self.SEGMENT_DURATION_MS
             end_ms = min((i + 1) * self.SEGMENT_DURATION_MS, total_duration)
@@ -220,7 +321,7 @@ class AudioProcessor:
             segment = audio[start_ms:end_ms]
 
             # 一時ファイルに保存
-            output_path = tempfile.mktemp(suffix=f"_segment_{i+1}.mp3")
+            output_path = _mktemp(suffix=f"_segment_{i+1}.mp3")
             segment.export(
                 output_path,
                 format="mp3",
@@ -260,7 +361,7 @@ class AudioProcessor:
         segment_duration_ms = int(TARGET_SIZE_BYTES / estimated_bytes_per_ms)
 
         # セグメント数を計算
-        num_segments = (total_duration // segment_duration_ms) + 1
+        num_segments = max(1, math.ceil(total_duration / segment_duration_ms))
         total_hours = total_duration / (1000 * 60 * 60)
         segment_hours = segment_duration_ms / (1000 * 60 * 60)
 
@@ -277,7 +378,7 @@ class AudioProcessor:
             segment = audio[start_ms:end_ms]
 
             # 一時ファイルに保存
-            output_path = tempfile.mktemp(suffix=f"_segment_{i+1}.mp3")
+            output_path = _mktemp(suffix=f"_segment_{i+1}.mp3")
             segment.export(
                 output_path,
                 format="mp3",
@@ -304,17 +405,21 @@ class AudioProcessor:
 
         return segment_paths
 
-    def _split_audio_with_ffmpeg(self, file_path: str, size_based: bool = False) -> List[str]:
+    def _split_audio_with_ffmpeg(self, file_path: str, size_based: Optional[bool] = None) -> List[str]:
         """
         ffmpegを使用して音声ファイルを1時間ごとに分割
 
         Args:
             file_path: 入力音声ファイルのパス
+            size_based: サイズベースで分割するか（Noneの場合は圧縮後の推定サイズが100MBを超えるときのみ）
 
         Returns:
             分割された音声ファイルのパスのリスト
         """
         segment_paths = []
+        # セグメント出力ファイル名の共通プレフィックス
+        output_prefix = _mktemp()
+        self.temp_files.append(output_prefix)
 
         # ffprobeのパスを取得
         if FFMPEG_PATH == 'ffmpeg':
@@ -323,11 +428,12 @@ class AudioProcessor:
             ffprobe_path = FFMPEG_PATH.replace('ffmpeg.exe', 'ffprobe.exe')
 
         try:
-            # 音声ファイルの長さを取得
+            # 音声ファイルの長さとストリーム情報を取得
             probe_cmd = [
                 ffprobe_path,
                 '-v', 'error',
-                '-show_entries', 'format=duration',
+                '-show_entries', 'format=duration:stream=codec_name,sample_rate,channels,bit_rate',
+                '-select_streams', 'a:0',
                 '-of', 'json',
                 file_path
             ]
@@ -348,6 +454,27 @@ class AudioProcessor:
 
             logger.info(f"音声の長さ: {total_duration:.2f}秒 ({total_hours:.2f}時間)")
 
+            # 既に目標形式（mp3, 16kHz, モノラル, 64kbps以下）なら再エンコードしない
+            streams = duration_data.get('streams') or [{}]
+            stream = streams[0]
+            already_target = (
+                stream.get('codec_name') == 'mp3' and
+                stream.get('sample_rate') == str(self.TARGET_SAMPLE_RATE) and
+                stream.get('channels') == 1 and
+                stream.get('bit_rate') is not None and
+                int(stream['bit_rate']) <= 64000
+            )
+            if already_target:
+                logger.info("入力が既に目標形式のため、再エンコードせずにストリームコピーします")
+                codec_args = ['-c:a', 'copy', '-avoid_negative_ts', 'make_zero']
+            else:
+                codec_args = ['-c:a', 'libmp3lame', '-b:a', '64k', '-ar', '16000', '-ac', '1']
+
+            # 圧縮後（64kbps）の推定サイズが100MBを超える場合のみサイズベースで分割
+            if size_based is None:
+                estimated_size = total_duration * (self.TARGET_BITRATE_BPS / 8)
+                size_based = estimated_size > self.MAX_FILE_SIZE_BYTES
+
             # サイズベースまたは時間ベースで分割
             if size_based:
                 # 推定: 64kbps = 8KB/秒、90MBをターゲット
@@ -360,58 +487,17 @@ class AudioProcessor:
                 segment_duration = 3600
                 logger.info("時間ベース分割: 各セグメント1時間")
 
-            num_segments = int(total_duration // segment_duration) + 1
+            num_segments = max(1, math.ceil(total_duration / segment_duration))
 
             logger.info(f"音声を {num_segments} 個のセグメントに分割")
 
-            for i in range(num_segments):
-                start_time = i * segment_duration
-
-                # 最後のセグメントの長さを調整
-                if i == num_segments - 1:
-                    duration = total_duration - start_time
-                else:
-                    duration = segment_duration
-
-                # 出力ファイルパス
-                output_path = tempfile.mktemp(suffix=f"_segment_{i+1}.mp3")
-
-                # ffmpegコマンドで分割
-                split_cmd = [
-                    FFMPEG_PATH,
-                    '-i', file_path,
-                    '-ss', str(start_time),
-                    '-t', str(duration),
-                    '-c:a', 'libmp3lame',
-                    '-b:a', '64k',
-                    '-ar', '16000',
-                    '-ac', '1',
-                    '-y',
-                    output_path
-                ]
-
-                logger.info(f"セグメント {i+1}/{num_segments} を処理中 ({start_time/3600:.2f}h - {(start_time+duration)/3600:.2f}h)")
-
-                split_result = subprocess.run(
-                    split_cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=300
-                )
-
-                if split_result.returncode != 0:
-                    logger.error(f"ffmpegエラー: {split_result.stderr}")
-                    raise RuntimeError(f"セグメント {i+1} の処理に失敗しました")
-
-                segment_size = os.path.getsize(output_path)
-                logger.info(
-                    f"セグメント {i+1}/{num_segments} 作成完了 "
-                    f"({start_time/3600:.2f}時間 - {(start_time+duration)/3600:.2f}時間, "
-                    f"{segment_size / (1024 * 1024):.2f} MB)"
-                )
-
-                segment_paths.append(output_path)
-                self.temp_files.append(output_path)
+            segment_paths = self._run_segment_muxer(
+                file_path,
+                segment_duration,
+                codec_args,
+                output_prefix,
+                timeout=300 * num_segments
+            )
 
             return segment_paths
 
@@ -421,7 +507,7 @@ class AudioProcessor:
         except Exception as e:
             logger.error(f"ffmpeg処理エラー: {str(e)}")
             # エラー時は作成したファイルをクリーンアップ
-            for path in segment_paths:
+            for path in glob.glob(output_prefix + '_segment_*.mp3'):
                 if os.path.exists(path):
                     try:
                         os.unlink(path)
@@ -429,18 +515,77 @@ class AudioProcessor:
                         pass
             raise
 
+    def _run_segment_muxer(
+        self,
+        input_path: str,
+        segment_duration: float,
+        codec_args: List[str],
+        output_prefix: str,
+        timeout: float
+    ) -> List[str]:
+        """
+        ffmpegのsegmentマルチプレクサで1回のデコードから全セグメントを出力
+
+        Args:
+            input_path: 入力音声ファイルのパス
+            segment_duration: 各セグメントの長さ（秒）
+            codec_args: 音声コーデック関連のffmpeg引数
+            output_prefix: 出力ファイル名の共通プレフィックス
+            timeout: ffmpegのタイムアウト（秒）
+
+        Returns:
+            分割された音声ファイルのパスのリスト
+        """
+        split_cmd = [
+            FFMPEG_PATH,
+            '-i', input_path,
+            '-f', 'segment',
+            '-segment_time', str(segment_duration),
+            '-reset_timestamps', '1',
+            *codec_args,
+            '-y',
+            output_prefix + '_segment_%03d.mp3'
+        ]
+
+        split_result = subprocess.run(
+            split_cmd,
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+
+        if split_result.returncode != 0:
+            logger.error(f"ffmpegエラー: {split_result.stderr}")
+            raise RuntimeError("セグメントの処理に失敗しました")
+
+        segment_paths = sorted(glob.glob(output_prefix + '_segment_*.mp3'))
+        for i, output_path in enumerate(segment_paths):
+            segment_size = os.path.getsize(output_path)
+            logger.info(
+                f"セグメント {i+1}/{len(segment_paths)} 作成完了 "
+                f"({segment_size / (1024 * 1024):.2f} MB)"
+            )
+            self.temp_files.append(output_path)
+
+        return segment_paths
+
     def cleanup(self):
         """一時ファイルのクリーンアップ"""
         for temp_file in self.temp_files:
             try:
-                if os.path.exists(temp_file):
-                    os.unlink(temp_file)
-                    logger.debug(f"一時ファイル削除: {temp_file}")
-            except Exception as e:
+                os.unlink(temp_file)
+                logger.debug(f"一時ファイル削除: {temp_file}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
                 logger.warning(f"一時ファイル削除エラー: {temp_file} - {str(e)}")
         
         self.temp_files.clear()
-    
-    def __del__(self):
-        """デストラクタ - 一時ファイルのクリーンアップ"""
-        self.cleanup()
+
+    async def __aenter__(self):
+        """コンテキスト開始"""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """コンテキスト終了時に一時ファイルをクリーンアップ（ファイル削除はスレッドでまとめて実行）"""
+        await asyncio.to_thread(self.cleanup)
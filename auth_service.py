@@ -5,18 +5,55 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict
 import jwt
 import bcrypt
+import hashlib
+import hmac
 import os
+import time
+import asyncio
 import logging
 from google.cloud import firestore
 
 logger = logging.getLogger(__name__)
 
+# bcryptのコストファクター（対話的なログイン向けにデフォルトは10）
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+
+# Firestoreのユーザー情報キャッシュの有効期間（秒）
+# パスワード変更時のキャッシュ破棄は同一プロセス内のみ。他のワーカー・インスタンスでは
+# 最大この秒数だけ古いpassword_hashで検証される（新パスワードが拒否され、旧パスワードが通る）ため短くしている
+USER_CACHE_TTL_SECONDS = 5
+
+# ログイン成功結果のキャッシュ有効期間（秒）。同一資格情報での再試行時にbcrypt検証を省略
+LOGIN_CACHE_TTL_SECONDS = 5
+
+# 検証済みJWTペイロードのキャッシュ設定
+JWT_CACHE_TTL_SECONDS = 30
+JWT_CACHE_MAX_ENTRIES = 10000
+
 class AuthService:
     def __init__(self):
         """認証サービスの初期化"""
         self.secret_key = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
         self.algorithm = "HS256"
         self.access_token_expire_minutes = 480  # 8時間
+
+        # jwt.decodeに毎回渡す引数（リクエストごとの生成を避けるため事前に作成）
+        self._decode_algorithms = [self.algorithm]
+        self._decode_options = {"require": ["exp", "sub"]}
+
+        # デモ用のユーザーデータ（初回アクセス時に作成）
+        self._demo_users: Optional[Dict] = None
+
+        # Firestoreのユーザー情報キャッシュ（ユーザー名 -> (取得時刻, ユーザーデータ)）
+        self._user_cache: Dict[str, tuple] = {}
+
+        # 検証済みJWTのキャッシュ（トークンのSHA-256 -> (検証時刻, ペイロード)）
+        self._token_cache: Dict[bytes, tuple] = {}
+
+        # ログイン成功結果のキャッシュ（資格情報のHMAC -> (認証時刻, ユーザー情報)）
+        # パスワードを平文やハッシュのまま保持しないよう、プロセスごとのランダムな鍵でHMACを取る
+        self._login_cache: Dict[bytes, tuple] = {}
+        self._login_cache_key = os.urandom(32)
         
         # Firestoreクライアントの初期化
         self.db = None
@@ -24,7 +61,7 @@ class AuthService:
         try:
             # Firestoreの認証情報が設定されているかチェック
             if os.getenv("GOOGLE_APPLICATION_CREDENTIALS") or os.getenv("FIRESTORE_PROJECT_ID"):
-                self.db = firestore.Client()
+                self.db = firestore.AsyncClient()
                 self.users_collection = self.db.collection("users")
                 logger.info("Firestore接続成功")
             else:
@@ -33,13 +70,25 @@ class AuthService:
             logger.warning(f"Firestore接続エラー: {str(e)}. デモモードで動作します")
             self.db = None
 
-        # デモ用のユーザーデータ（Firestoreが利用できない場合に使用）
-        self._demo_users = self._create_demo_users()
-    
+    async def _get_demo_users(self) -> Dict:
+        """
+        デモ用のユーザーデータを取得（Firestoreが利用できない場合に初回アクセス時に作成）
+
+        Returns:
+            ユーザー名 -> ユーザーデータの辞書
+        """
+        if self._demo_users is None:
+            # bcryptによるハッシュ化はCPU負荷が高いためスレッドで実行
+            demo_users = await asyncio.to_thread(self._create_demo_users)
+            # 作成中に他のリクエストが先に設定していた場合はそちらを使用
+            if self._demo_users is None:
+                self._demo_users = demo_users
+        return self._demo_users
+
     def _create_demo_users(self) -> Dict:
         """デモ用のユーザーを作成（開発・テスト用）"""
         demo_password = "demo123"
-        hashed = bcrypt.hashpw(demo_password.encode('utf-8'), bcrypt.gensalt())
+        hashed = bcrypt.hashpw(demo_password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS))
         
         return {
             "demo": {
@@ -67,20 +116,35 @@ class AuthService:
         Returns:
             認証成功時はユーザー情報、失敗時はNone
         """
+        # 直近に同じ資格情報で認証に成功していればキャッシュを返す
+        login_key = hmac.new(
+            self._login_cache_key,
+            f"{username}\0{password}".encode('utf-8'),
+            hashlib.sha256
+        ).digest()
+        entry = self._login_cache.get(login_key)
+        if entry and time.monotonic() - entry[0] < LOGIN_CACHE_TTL_SECONDS:
+            return entry[1]
+
         try:
             # Firestoreからユーザー情報を取得
             if self.db:
-                user_ref = self.users_collection.document(username)
-                user_doc = user_ref.get()
-                
-                if not user_doc.exists:
-                    logger.warning(f"ユーザーが見つかりません: {username}")
-                    return None
-                
-                user_data = user_doc.to_dict()
+                entry = self._user_cache.get(username)
+                if entry and time.monotonic() - entry[0] < USER_CACHE_TTL_SECONDS:
+                    user_data = entry[1]
+                else:
+                    user_ref = self.users_collection.document(username)
+                    user_doc = await user_ref.get()
+
+                    if not user_doc.exists:
+                        logger.warning(f"ユーザーが見つかりません: {username}")
+                        return None
+
+                    user_data = user_doc.to_dict()
+                    self._user_cache[username] = (time.monotonic(), user_data)
             else:
                 # デモモード
-                user_data = self._demo_users.get(username)
+                user_data = (await self._get_demo_users()).get(username)
                 if not user_data:
                     logger.warning(f"デモユーザーが見つかりません: {username}")
                     return None
@@ -91,8 +155,9 @@ class AuthService:
                 logger.error(f"パスワードハッシュが存在しません: {username}")
                 return None
             
-            # bcryptでパスワード検証
-            is_valid = bcrypt.checkpw(
+            # bcryptでパスワード検証（CPU負荷が高いためスレッドで実行）
+            is_valid = await asyncio.to_thread(
+                bcrypt.checkpw,
                 password.encode('utf-8'),
                 stored_password_hash.encode('utf-8')
             )
@@ -102,10 +167,12 @@ class AuthService:
                 return None
             
             logger.info(f"ユーザー認証成功: {username}")
-            return {
+            user = {
                 "username": username,
                 "name": user_data.get("name", username)
             }
+            self._login_cache[login_key] = (time.monotonic(), user)
+            return user
         
         except Exception as e:
             logger.error(f"認証処理エラー: {str(e)}")
@@ -136,6 +203,42 @@ class AuthService:
         logger.info(f"アクセストークン生成: {data.get('sub')}, 有効期限: {expire}")
         return encoded_jwt
     
+    def decode_token(self, token: str) -> Dict:
+        """
+        JWTアクセストークンを検証してペイロードを取得
+
+        Args:
+            token: JWTトークン
+
+        Returns:
+            トークンのペイロード
+
+        Raises:
+            jwt.ExpiredSignatureError: トークンの有効期限切れ
+            jwt.InvalidTokenError: 無効なトークン（exp・subクレームの欠落を含む）
+        """
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        entry = self._token_cache.get(key)
+        if entry and time.monotonic() - entry[0] < JWT_CACHE_TTL_SECONDS:
+            payload = entry[1]
+        else:
+            # 検証に失敗した場合は例外がそのまま送出され、キャッシュされない
+            payload = jwt.decode(
+                token,
+                self.secret_key,
+                algorithms=self._decode_algorithms,
+                options=self._decode_options
+            )
+            if len(self._token_cache) >= JWT_CACHE_MAX_ENTRIES:
+                self._token_cache.clear()
+            self._token_cache[key] = (time.monotonic(), payload)
+
+        # キャッシュ済みのペイロードも有効期限を再確認
+        if payload["exp"] <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+        return payload
+
     async def create_user(self, username: str, password: str, name: str) -> bool:
         """
         新規ユーザーを作成
@@ -150,7 +253,9 @@ class AuthService:
         """
         try:
             # パスワードのハッシュ化
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            password_hash = await asyncio.to_thread(
+                bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)
+            )
             
             user_data = {
                 "username": username,
@@ -161,11 +266,12 @@ class AuthService:
             
             if self.db:
                 # Firestoreに保存
-                self.users_collection.document(username).set(user_data)
+                await self.users_collection.document(username).set(user_data)
+                self._user_cache.pop(username, None)
                 logger.info(f"新規ユーザー作成成功: {username}")
             else:
                 # デモモードでは作成をシミュレート
-                self._demo_users[username] = user_data
+                (await self._get_demo_users())[username] = user_data
                 logger.info(f"デモモードで新規ユーザー作成: {username}")
             
             return True
@@ -194,19 +300,26 @@ class AuthService:
                 return False
             
             # 新しいパスワードのハッシュ化
-            new_password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+            new_password_hash = await asyncio.to_thread(
+                bcrypt.hashpw, new_password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)
+            )
             
             if self.db:
                 # Firestoreを更新
-                self.users_collection.document(username).update({
+                await self.users_collection.document(username).update({
                     "password_hash": new_password_hash.decode('utf-8'),
                     "password_updated_at": datetime.now().isoformat()
                 })
+                self._user_cache.pop(username, None)
             else:
                 # デモモード
-                if username in self._demo_users:
-                    self._demo_users[username]["password_hash"] = new_password_hash.decode('utf-8')
+                demo_users = await self._get_demo_users()
+                if username in demo_users:
+                    demo_users[username]["password_hash"] = new_password_hash.decode('utf-8')
             
+            # 古いパスワードでのログインがキャッシュから通らないよう破棄
+            self._login_cache.clear()
+
             logger.info(f"パスワード変更成功: {username}")
             return True
         
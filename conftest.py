@@ -0,0 +1,3 @@
+"""
+pytestの設定（リポジトリ直下のモジュールをテストからインポートできるようにする）
+"""
@@ -4,6 +4,8 @@
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
@@ -12,64 +14,213 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.enums import TA_LEFT, TA_CENTER
 from reportlab.lib import colors
-import tempfile
+import io
 import os
+import re
 import logging
+import threading
+from xml.sax.saxutils import escape
+from functools import lru_cache
 from typing import Dict
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# ReportLabの段落マークアップ用エスケープ（&も含めて1パスで変換）
+_XML_ESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# PDFのページ設定（A4、余白20mm）
+_PDF_MARGIN = 20 * mm
+_PDF_PAGE_KWARGS = dict(
+    pagesize=A4,
+    rightMargin=_PDF_MARGIN,
+    leftMargin=_PDF_MARGIN,
+    topMargin=_PDF_MARGIN,
+    bottomMargin=_PDF_MARGIN
+)
+
+# 本文の行分類（見出し「##」または箇条書き記号「・」「• 」「- 」「* 」）
+# group(1): 行頭の記号、group(2): 記号を除いた本文
+_LINE_RE = re.compile(r'^(##+\s*|・\s*|•\s+|-\s+|\*\s+)(.*)$')
+
+def _paragraph_xml(text: str, style_id: str = None):
+    """
+    Word段落（w:p）要素をXMLから直接作成
+
+    Args:
+        text: 段落のテキスト
+        style_id: 段落スタイルのID（省略時は既定のスタイル）
+
+    Returns:
+        w:p要素
+    """
+    ppr = f'<w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>' if style_id else ''
+    return parse_xml(
+        f'<w:p {nsdecls("w")}>{ppr}'
+        f'<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+    )
+
+def _footer_text(metadata: Dict) -> str:
+    """
+    フッターの作成日時テキストを作成
+
+    Args:
+        metadata: メタデータ（generated_atがあればその日時を使用）
+
+    Returns:
+        フッターのテキスト
+    """
+    generated_at = metadata.get('generated_at') or datetime.now()
+    return f"作成日時: {generated_at.strftime('%Y年%m月%d日 %H:%M')}"
+
 class DocumentGenerator:
     def __init__(self):
         """ドキュメント生成の初期化"""
-        # 日本語フォントの設定（ReportLab用）
-        self.japanese_font_available = False
-        try:
-            # システムの日本語フォントを試行
-            # (フォントパス, TTCインデックス) のタプル
-            font_configs = [
-                ("C:\\Windows\\Fonts\\msgothic.ttc", 0),  # MS ゴシック (Windows)
-                ("C:\\Windows\\Fonts\\msmincho.ttc", 0),  # MS 明朝 (Windows)
-                ("C:\\Windows\\Fonts\\meiryo.ttc", 0),  # メイリオ (Windows)
-                ("C:\\Windows\\Fonts\\yugothic.ttf", None),  # 游ゴシック (Windows)
-                ("/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc", 0),  # ヒラギノ (macOS)
-                ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", None),  # Linux
-            ]
+        # 日本語フォントとPDF用スタイルは初回のPDF生成時に設定する
+        self.japanese_font_available = None
+        self._pdf_styles = None
+        self._font_lock = threading.Lock()
 
-            for font_path, ttc_index in font_configs:
-                if os.path.exists(font_path):
-                    try:
-                        # TTCファイルの場合はsubfontIndexを指定
-                        if ttc_index is not None and font_path.endswith('.ttc'):
-                            pdfmetrics.registerFont(TTFont('Japanese', font_path, subfontIndex=ttc_index))
-                        else:
-                            pdfmetrics.registerFont(TTFont('Japanese', font_path))
-
-                        self.japanese_font_available = True
-                        logger.info(f"日本語フォント登録成功: {font_path}" +
-                                  (f" (index: {ttc_index})" if ttc_index is not None else ""))
-                        break
-                    except Exception as e:
-                        logger.debug(f"フォント登録失敗: {font_path} - {str(e)}")
-                        continue
-
-            if not self.japanese_font_available:
-                logger.warning("日本語フォントが見つかりません。PDF生成時にフォールバックを使用します")
+    def _ensure_font(self):
+        """日本語フォントの登録とPDF用スタイルの作成（初回のみ実行）"""
+        if self._pdf_styles is not None:
+            return
 
-        except Exception as e:
-            logger.warning(f"日本語フォント設定エラー: {str(e)}")
+        with self._font_lock:
+            if self._pdf_styles is not None:
+                return
+
+            # 日本語フォントの設定（ReportLab用）
+            self.japanese_font_available = False
+            try:
+                # システムの日本語フォントを試行
+                # (フォントパス, TTCインデックス) のタプル
+                font_configs = [
+                    ("C:\\Windows\\Fonts\\msgothic.ttc", 0),  # MS ゴシック (Windows)
+                    ("C:\\Windows\\Fonts\\msmincho.ttc", 0),  # MS 明朝 (Windows)
+                    ("C:\\Windows\\Fonts\\meiryo.ttc", 0),  # メイリオ (Windows)
+                    ("C:\\Windows\\Fonts\\yugothic.ttf", None),  # 游ゴシック (Windows)
+                    ("/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc", 0),  # ヒラギノ (macOS)
+                    ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", None),  # Linux
+                ]
+
+                for font_path, ttc_index in font_configs:
+                    if os.path.exists(font_path):
+                        try:
+                            # TTCファイルの場合はsubfontIndexを指定
+                            if ttc_index is not None and font_path.endswith('.ttc'):
+                                pdfmetrics.registerFont(TTFont('Japanese', font_path, subfontIndex=ttc_index))
+                            else:
+                                pdfmetrics.registerFont(TTFont('Japanese', font_path))
+
+                            self.japanese_font_available = True
+                            logger.info(f"日本語フォント登録成功: {font_path}" +
+                                      (f" (index: {ttc_index})" if ttc_index is not None else ""))
+                            break
+                        except Exception as e:
+                            logger.debug(f"フォント登録失敗: {font_path} - {str(e)}")
+                            continue
+
+                if not self.japanese_font_available:
+                    logger.warning("日本語フォントが見つかりません。PDF生成時にフォールバックを使用します")
+
+            except Exception as e:
+                logger.warning(f"日本語フォント設定エラー: {str(e)}")
+
+            # PDF用スタイルはフォント設定にのみ依存するため一度だけ作成
+            self._pdf_styles = self._build_pdf_styles()
+
+    def _build_pdf_styles(self) -> Dict[str, ParagraphStyle]:
+        """
+        PDF用の段落スタイルを作成
+
+        Returns:
+            用途ごとのParagraphStyleの辞書
+        """
+        # スタイルの取得と設定
+        styles = getSampleStyleSheet()
+
+        # フォント名の設定
+        font_name = 'Japanese' if self.japanese_font_available else 'Helvetica'
+
+        return {
+            'title': ParagraphStyle(
+                'CustomTitle',
+                parent=styles['Heading1'],
+                fontName=font_name,
+                fontSize=20,
+                alignment=TA_CENTER,
+                spaceAfter=30,
+                textColor=colors.HexColor('#1a1a1a')
+            ),
+            'heading1': ParagraphStyle(
+                'CustomHeading1',
+                parent=styles['Heading2'],
+                fontName=font_name,
+                fontSize=15,
+                spaceAfter=15,
+                spaceBefore=20,
+                textColor=colors.HexColor('#2c3e50'),
+                leftIndent=0
+            ),
+            'heading2': ParagraphStyle(
+                'CustomHeading2',
+                parent=styles['Heading2'],
+                fontName=font_name,
+                fontSize=12,
+                spaceAfter=10,
+                spaceBefore=10,
+                textColor=colors.HexColor('#34495e'),
+                leftIndent=15
+            ),
+            'body': ParagraphStyle(
+                'CustomBody',
+                parent=styles['BodyText'],
+                fontName=font_name,
+                fontSize=10,
+                spaceAfter=8,
+                leading=16,
+                leftIndent=0
+            ),
+            'list': ParagraphStyle(
+                'CustomList',
+                parent=styles['BodyText'],
+                fontName=font_name,
+                fontSize=10,
+                spaceAfter=6,
+                leading=16,
+                leftIndent=25,
+                bulletIndent=10
+            ),
+            'metadata': ParagraphStyle(
+                'MetadataStyle',
+                parent=styles['BodyText'],
+                fontName=font_name,
+                fontSize=9,
+                spaceAfter=4,
+                leading=13,
+                textColor=colors.HexColor('#555555')
+            ),
+            'footer': ParagraphStyle(
+                'Footer',
+                parent=styles['Normal'],
+                fontName=font_name,
+                fontSize=9,
+                textColor='gray',
+                alignment=TA_CENTER
+            ),
+        }
     
-    def generate_word(self, content: str, metadata: Dict) -> str:
+    def generate_word(self, content: str, metadata: Dict) -> bytes:
         """
         Word文書を生成
         
         Args:
             content: 議事録の本文
-            metadata: メタデータ（日付、作成者など）
+            metadata: メタデータ（日付、作成者、generated_at（作成日時、省略可）など）
             
         Returns:
-            生成されたWordファイルのパス
+            生成されたWordファイルの内容
         """
         try:
             logger.info("Word文書の生成を開始")
@@ -106,149 +257,84 @@ class DocumentGenerator:
             doc.add_paragraph()
             doc.add_heading('内容', level=1)
             
+            # 箇条書き・通常段落はXML要素を直接追加（add_paragraphのオーバーヘッドを回避）
+            bullet_style_id = doc.styles['List Bullet'].style_id
+            body = doc.element.body
+            sect_pr = body.sectPr
+
+            def append_paragraph(text, style_id=None):
+                p = _paragraph_xml(text, style_id)
+                if sect_pr is not None:
+                    sect_pr.addprevious(p)
+                else:
+                    body.append(p)
+
             # 内容を行ごとに処理
-            for line in content.split('\n'):
+            for line in content.splitlines():
                 line = line.strip()
                 if not line:
                     continue
 
+                m = _LINE_RE.match(line)
                 # セクションヘッダーの判定（##で始まる）
-                if line.startswith('##'):
-                    heading_text = line.replace('##', '').strip()
-                    doc.add_heading(heading_text, level=2)
+                if m and m.group(1)[0] == '#':
+                    doc.add_heading(m.group(2), level=2)
                 # 箇条書きの判定（・、•、-、* で始まる）
-                elif line.startswith(('・', '• ', '- ', '* ')):
-                    # 箇条書き記号を除去
-                    for prefix in ['・', '• ', '- ', '* ']:
-                        if line.startswith(prefix):
-                            line = line[len(prefix):].strip()
-                            break
-                    p = doc.add_paragraph(line, style='List Bullet')
+                elif m:
+                    append_paragraph(m.group(2), bullet_style_id)
                 else:
                     # 通常の段落
-                    doc.add_paragraph(line)
+                    append_paragraph(line)
             
             # フッター
             doc.add_paragraph()
-            footer = doc.add_paragraph(f"作成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}")
+            footer = doc.add_paragraph(_footer_text(metadata))
             footer.alignment = WD_ALIGN_PARAGRAPH.RIGHT
             footer_run = footer.runs[0]
             footer_run.font.size = Pt(9)
             footer_run.font.color.rgb = RGBColor(128, 128, 128)
             
-            # 一時ファイルに保存
-            output_path = tempfile.mktemp(suffix=".docx")
-            doc.save(output_path)
+            # メモリ上に保存
+            buffer = io.BytesIO()
+            doc.save(buffer)
+            output = buffer.getvalue()
             
-            logger.info(f"Word文書生成完了: {output_path}")
-            return output_path
+            logger.info(f"Word文書生成完了: {len(output) / 1024:.1f} KB")
+            return output
         
         except Exception as e:
             logger.error(f"Word文書生成エラー: {str(e)}")
             raise
     
-    def generate_pdf(self, content: str, metadata: Dict) -> str:
+    def generate_pdf(self, content: str, metadata: Dict) -> bytes:
         """
         PDF文書を生成
         
         Args:
             content: 議事録の本文
-            metadata: メタデータ（日付、作成者など）
+            metadata: メタデータ（日付、作成者、generated_at（作成日時、省略可）など）
             
         Returns:
-            生成されたPDFファイルのパス
+            生成されたPDFファイルの内容
         """
         try:
             logger.info("PDF文書の生成を開始")
+            self._ensure_font()
             
-            # 一時ファイルパス
-            output_path = tempfile.mktemp(suffix=".pdf")
+            # メモリ上に出力
+            buffer = io.BytesIO()
             
             # PDFドキュメント作成
-            doc = SimpleDocTemplate(
-                output_path,
-                pagesize=A4,
-                rightMargin=20*mm,
-                leftMargin=20*mm,
-                topMargin=20*mm,
-                bottomMargin=20*mm
-            )
+            doc = SimpleDocTemplate(buffer, **_PDF_PAGE_KWARGS)
             
             # ストーリー（コンテンツ）のリスト
             story = []
             
-            # スタイルの取得と設定
-            styles = getSampleStyleSheet()
+            # キャッシュ済みのスタイル
+            pdf_styles = self._pdf_styles
 
-            # フォント名の設定
-            font_name = 'Japanese' if self.japanese_font_available else 'Helvetica'
-
-            # カスタムスタイルの追加
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontName=font_name,
-                fontSize=20,
-                alignment=TA_CENTER,
-                spaceAfter=30,
-                textColor=colors.HexColor('#1a1a1a')
-            )
-
-            heading1_style = ParagraphStyle(
-                'CustomHeading1',
-                parent=styles['Heading2'],
-                fontName=font_name,
-                fontSize=15,
-                spaceAfter=15,
-                spaceBefore=20,
-                textColor=colors.HexColor('#2c3e50'),
-                leftIndent=0
-            )
-
-            heading2_style = ParagraphStyle(
-                'CustomHeading2',
-                parent=styles['Heading2'],
-                fontName=font_name,
-                fontSize=12,
-                spaceAfter=10,
-                spaceBefore=10,
-                textColor=colors.HexColor('#34495e'),
-                leftIndent=15
-            )
-
-            body_style = ParagraphStyle(
-                'CustomBody',
-                parent=styles['BodyText'],
-                fontName=font_name,
-                fontSize=10,
-                spaceAfter=8,
-                leading=16,
-                leftIndent=0
-            )
-
-            list_style = ParagraphStyle(
-                'CustomList',
-                parent=styles['BodyText'],
-                fontName=font_name,
-                fontSize=10,
-                spaceAfter=6,
-                leading=16,
-                leftIndent=25,
-                bulletIndent=10
-            )
-
-            metadata_style = ParagraphStyle(
-                'MetadataStyle',
-                parent=styles['BodyText'],
-                fontName=font_name,
-                fontSize=9,
-                spaceAfter=4,
-                leading=13,
-                textColor=colors.HexColor('#555555')
-            )
-            
             # タイトル
-            story.append(Paragraph('議事録', title_style))
+            story.append(Paragraph('議事録', pdf_styles['title']))
             story.append(Spacer(1, 15))
 
             # メタデータ
@@ -260,64 +346,55 @@ class DocumentGenerator:
             ]
 
             for item in meta_items:
-                story.append(Paragraph(item, metadata_style))
+                story.append(Paragraph(item, pdf_styles['metadata']))
 
             story.append(Spacer(1, 25))
 
             # 本文を処理
-            lines = content.split('\n')
-            i = 0
-            while i < len(lines):
-                line = lines[i].strip()
+            for line in content.splitlines():
+                line = line.strip()
 
                 if not line:
-                    i += 1
                     continue
 
+                m = _LINE_RE.match(line)
+
                 # ## で始まる行は大見出し（レベル1）
-                if line.startswith('##'):
-                    heading_text = line.replace('##', '').strip()
+                if m and m.group(1)[0] == '#':
                     story.append(Spacer(1, 5))
-                    story.append(Paragraph(heading_text, heading1_style))
+                    story.append(Paragraph(m.group(2).translate(_XML_ESCAPE), pdf_styles['heading1']))
 
-                # ・で始まる行は箇条書き
-                elif line.startswith('・'):
-                    story.append(Paragraph(line, list_style))
-
-                # その他の箇条書き記号
-                elif line.startswith(('• ', '- ', '* ')):
-                    story.append(Paragraph(line, list_style))
+                # 箇条書き（・、•、-、*）は記号ごと表示（見出し・箇条書きもHTMLタグをエスケープ）
+                elif m:
+                    story.append(Paragraph(line.translate(_XML_ESCAPE), pdf_styles['list']))
 
                 # 通常のテキスト
                 else:
                     # HTMLタグをエスケープ
-                    safe_text = line.replace('<', '&lt;').replace('>', '&gt;')
+                    safe_text = line.translate(_XML_ESCAPE)
 
                     # 改行を保持しつつ、適切なスペーシング
                     if safe_text:
-                        story.append(Paragraph(safe_text, body_style))
-
-                i += 1
+                        story.append(Paragraph(safe_text, pdf_styles['body']))
             
             # フッター
             story.append(Spacer(1, 30))
-            footer_text = f"作成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}"
-            footer_style = ParagraphStyle(
-                'Footer',
-                parent=styles['Normal'],
-                fontName=font_name,
-                fontSize=9,
-                textColor='gray',
-                alignment=TA_CENTER
-            )
-            story.append(Paragraph(footer_text, footer_style))
+            story.append(Paragraph(_footer_text(metadata), pdf_styles['footer']))
             
             # PDFビルド
             doc.build(story)
             
-            logger.info(f"PDF文書生成完了: {output_path}")
-            return output_path
+            output = buffer.getvalue()
+            
+            logger.info(f"PDF文書生成完了: {len(output) / 1024:.1f} KB")
+            return output
         
         except Exception as e:
             logger.error(f"PDF文書生成エラー: {str(e)}")
             raise
+
+
+@lru_cache(maxsize=1)
+def get_document_generator() -> DocumentGenerator:
+    """DocumentGeneratorのシングルトンを取得（フォント登録はプロセスごとに1回）"""
+    return DocumentGenerator()
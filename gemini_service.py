@@ -4,11 +4,59 @@ Google Gemini APIを使用した音声解析サービス
 import google.generativeai as genai
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import Dict, List, Any
+import asyncio
+import re
 import time
 
 logger = logging.getLogger(__name__)
 
+# 要約の合計文字数がこの値未満の場合はGeminiを呼ばずにローカルで結合（0で無効）
+LOCAL_MERGE_MAX_CHARS = int(os.getenv("SUMMARY_LOCAL_MERGE_MAX_CHARS", "2000"))
+
+# Gemini SDKのブロッキング呼び出し専用のスレッドプール
+# 数分かかる呼び出しがイベントループ既定のエグゼキュータ（bcrypt・音声処理などと共有）を占有しないよう分離する
+GEMINI_MAX_WORKERS = int(os.getenv("GEMINI_MAX_WORKERS", "16"))
+_gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_WORKERS, thread_name_prefix="gemini")
+
+async def _run_in_gemini_executor(func, *args, **kwargs):
+    """
+    Gemini SDKの同期関数を専用スレッドプールで実行
+
+    Args:
+        func: 実行する関数
+        *args: 関数に渡す位置引数
+        **kwargs: 関数に渡すキーワード引数
+
+    Returns:
+        関数の戻り値
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_gemini_executor, partial(func, *args, **kwargs))
+
+# 確認事項の各行から箇条書き記号（•、-、*、・、数字.）を除いた本文を抽出
+# 記号だけの行（「・」など）は項目として扱わない
+_CONF_ITEM_RE = re.compile(
+    r'^[^\S\n]*(?:[•\-*] |・)?[^\S\n]*(?:\d{1,2}\. )?[^\S\n]*'
+    r'(?![•\-*・][^\S\n]*$)(\S.*?)[^\S\n]*$',
+    re.MULTILINE
+)
+
+def _safe_delete_file(name: str):
+    """
+    Geminiにアップロードしたファイルを削除（エラーはログのみ）
+
+    Args:
+        name: アップロードファイル名
+    """
+    try:
+        genai.delete_file(name)
+        logger.info("アップロードファイルを削除")
+    except Exception as e:
+        logger.warning(f"ファイル削除エラー: {str(e)}")
+
 class GeminiService:
     def __init__(self):
         """Gemini APIサービスの初期化"""
@@ -29,6 +77,9 @@ class GeminiService:
             logger.error(f"Gemini API設定エラー: {str(e)}")
             raise
 
+        # 実行中のバックグラウンドタスク（完了前にGCされないよう参照を保持）
+        self._background_tasks = set()
+
         # モデルの設定
         # Gemini 2.5/2.0は音声ファイルを直接処理できる
         # v1beta APIで利用可能なモデルを優先順位順に試す
@@ -45,6 +96,11 @@ class GeminiService:
         model_initialized = False
         last_error = None
 
+        # 環境変数でモデルが指定されている場合は探索を省略
+        forced_model = os.getenv("GEMINI_MODEL")
+        if forced_model:
+            model_names = [forced_model]
+
         for model_name in model_names:
             try:
                 self.model = genai.GenerativeModel(model_name)
@@ -134,6 +190,9 @@ class GeminiService:
 {summaries}
 
 上記の分割記録を統合して、上記の5つのセクション形式で出力してください。"""
+
+        # 統合プロンプトを差し込み位置の前後に分割しておく（str.formatの解析を省略）
+        self._merge_prompt_head, _, self._merge_prompt_tail = self.merge_prompt.partition("{summaries}")
     
     async def analyze_audio(self, audio_file_path: str) -> Dict[str, Any]:
         """
@@ -151,7 +210,7 @@ class GeminiService:
 
             # 音声ファイルをアップロード
             try:
-                audio_file = genai.upload_file(path=audio_file_path)
+                audio_file = await _run_in_gemini_executor(genai.upload_file, path=audio_file_path)
                 logger.info(f"ファイルアップロード完了: {audio_file.name}")
             except Exception as e:
                 logger.error(f"ファイルアップロードエラー: {str(e)}")
@@ -163,14 +222,15 @@ class GeminiService:
 
             # アップロード処理の完了を待機
             max_wait_time = 60  # 最大60秒待機
-            wait_count = 0
+            deadline = time.monotonic() + max_wait_time
+            delay = 0.25  # ポーリング間隔（指数バックオフ、最大4秒）
             while audio_file.state.name == "PROCESSING":
-                if wait_count >= max_wait_time / 2:
+                if time.monotonic() >= deadline:
                     raise TimeoutError("ファイル処理がタイムアウトしました")
                 logger.info("ファイル処理中...")
-                time.sleep(2)
-                audio_file = genai.get_file(audio_file.name)
-                wait_count += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 4.0)
+                audio_file = await _run_in_gemini_executor(genai.get_file, audio_file.name)
 
             if audio_file.state.name == "FAILED":
                 raise ValueError(f"ファイル処理に失敗しました: {audio_file.state.name}")
@@ -180,7 +240,8 @@ class GeminiService:
             # Geminiで解析（セグメント用のプロンプトを使用）
             logger.info("Gemini APIに解析リクエストを送信")
             try:
-                response = self.model.generate_content(
+                response = await _run_in_gemini_executor(
+                    self.model.generate_content,
                     [self.segment_prompt, audio_file],
                     generation_config=genai.types.GenerationConfig(
                         temperature=0.3,  # 創造性を抑えて正確性を重視
@@ -216,12 +277,10 @@ class GeminiService:
             # 確認事項部分を要約から除去
             summary = self._remove_confirmation_section(result_text)
             
-            # アップロードしたファイルを削除
-            try:
-                genai.delete_file(audio_file.name)
-                logger.info("アップロードファイルを削除")
-            except Exception as e:
-                logger.warning(f"ファイル削除エラー: {str(e)}")
+            # アップロードしたファイルはレスポンスを待たせずにバックグラウンドで削除
+            task = asyncio.create_task(_run_in_gemini_executor(_safe_delete_file, audio_file.name))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
             
             return {
                 "summary": summary.strip(),
@@ -232,6 +291,25 @@ class GeminiService:
             logger.error(f"Gemini API解析エラー: {str(e)}")
             raise
     
+    async def analyze_segments(self, audio_file_paths: List[str], max_concurrency: int = 4) -> List[Dict[str, Any]]:
+        """
+        複数の音声セグメントを並列に解析
+
+        Args:
+            audio_file_paths: 解析する音声ファイルのパスのリスト
+            max_concurrency: 同時に実行する解析の最大数
+
+        Returns:
+            セグメント順の解析結果のリスト
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def analyze_with_limit(audio_file_path: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.analyze_audio(audio_file_path)
+
+        return await asyncio.gather(*(analyze_with_limit(path) for path in audio_file_paths))
+    
     async def merge_summaries(self, summaries: List[str]) -> str:
         """
         複数の議事録要約を統合
@@ -242,18 +320,24 @@ class GeminiService:
         Returns:
             統合された要約
         """
+        # 短い要約は統合用のAPI呼び出しを省略して単純に結合
+        if sum(map(len, summaries)) < LOCAL_MERGE_MAX_CHARS:
+            logger.info(f"{len(summaries)} 個の要約をローカルで結合")
+            return "\n\n".join(summaries)
+
         try:
             logger.info(f"{len(summaries)} 個の要約を統合")
             
             # 要約を番号付きで結合
             numbered_summaries = "\n\n".join(
-                [f"--- セグメント {i+1} ---\n{summary}" 
-                 for i, summary in enumerate(summaries)]
+                f"--- セグメント {i+1} ---\n{summary}"
+                for i, summary in enumerate(summaries)
             )
             
-            prompt = self.merge_prompt.format(summaries=numbered_summaries)
+            prompt = self._merge_prompt_head + numbered_summaries + self._merge_prompt_tail
             
-            response = self.model.generate_content(
+            response = await _run_in_gemini_executor(
+                self.model.generate_content,
                 prompt,
                 generation_config=genai.types.GenerationConfig(
                     temperature=0.3,
@@ -283,39 +367,23 @@ class GeminiService:
         """
         items = []
         
-        # 【💡確認事項】セクションを探す
-        if "【💡確認事項】" in text or "💡確認事項" in text:
-            # セクションを分割
-            parts = text.split("【💡確認事項】")
-            if len(parts) < 2:
-                parts = text.split("💡確認事項")
+        # 【💡確認事項】セクションを探す（最初の出現のみ使用）
+        _, sep, confirmation_section = text.partition("【💡確認事項】")
+        if not sep:
+            _, sep, confirmation_section = text.partition("💡確認事項")
+        
+        if sep:
+            # 次のセクション（##で始まる）までを取得
+            next_section_idx = confirmation_section.find("\n##")
+            if next_section_idx != -1:
+                confirmation_section = confirmation_section[:next_section_idx]
             
-            if len(parts) >= 2:
-                confirmation_section = parts[1]
-                
-                # 次のセクション（##で始まる）までを取得
-                next_section_idx = confirmation_section.find("\n##")
-                if next_section_idx != -1:
-                    confirmation_section = confirmation_section[:next_section_idx]
-                
-                # 箇条書きを抽出（•、-、*、数字.で始まる行）
-                for line in confirmation_section.split("\n"):
-                    line = line.strip()
-                    if not line or line.lower() == "なし":
-                        continue
-                    
-                    # 箇条書き記号を除去
-                    for prefix in ["• ", "- ", "* ", "・"]:
-                        if line.startswith(prefix):
-                            line = line[len(prefix):].strip()
-                            break
-                    
-                    # 数字付き箇条書き（1. 2. など）を除去
-                    if line and line[0].isdigit() and ". " in line[:4]:
-                        line = line.split(". ", 1)[1].strip()
-                    
-                    if line:
-                        items.append(line)
+            # 箇条書き記号（•、-、*、・、数字.）を除いた各行を抽出
+            items = [
+                m.group(1)
+                for m in _CONF_ITEM_RE.finditer(confirmation_section)
+                if m.group(1).lower() != "なし"
+            ]
         
         logger.info(f"確認事項を {len(items)} 件抽出")
         return items
@@ -330,8 +398,14 @@ class GeminiService:
         Returns:
             確認事項を除去したテキスト
         """
-        if "【💡確認事項】" in text:
-            return text.split("【💡確認事項】")[0].strip()
-        elif "💡確認事項" in text:
-            return text.split("💡確認事項")[0].strip()
+        for marker in ("【💡確認事項】", "💡確認事項"):
+            head, sep, _ = text.partition(marker)
+            if sep:
+                return head.strip()
         return text
+
+
+@lru_cache(maxsize=1)
+def get_gemini_service() -> GeminiService:
+    """GeminiServiceのシングルトンを取得（モデル初期化はプロセスごとに1回）"""
+    return GeminiService()
@@ -1,17 +1,22 @@
 """
 議事録自動生成システム - FastAPI Backend
 """
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status, Form
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, HTMLResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional, List
+from contextlib import asynccontextmanager
 import os
+import json
+import hashlib
 import tempfile
 import logging
 import asyncio
+from urllib.parse import quote
 from datetime import datetime, timedelta
 import jwt
 from dotenv import load_dotenv
@@ -20,41 +25,134 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from audio_processor import AudioProcessor
-from gemini_service import GeminiService
+from gemini_service import GeminiService, get_gemini_service
 from auth_service import AuthService
-from document_generator import DocumentGenerator
+from document_generator import DocumentGenerator, get_document_generator
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """アプリケーションの起動・終了時の処理"""
+    # 静的ファイルを起動時に一度だけ読み込む
+    load_static_files()
+    yield
+
 # FastAPIアプリケーション初期化
 app = FastAPI(
     title="議事録自動生成システム",
     description="音声ファイルから議事録を自動生成するAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # ファイルアップロードサイズ制限を200MBに設定
 app.state.max_upload_size = 200 * 1024 * 1024  # 200MB
 
-# CORS設定
+# アップロードファイルを一時ファイルへ書き込む際のチャンクサイズ
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# 一時ファイルのサフィックスとしてそのまま使用する拡張子（ffmpeg/Geminiが扱える音声・動画形式）
+# これ以外の拡張子はサフィックスなしで保存し、形式の判定はffmpegに任せる
+ALLOWED_AUDIO_SUFFIXES = frozenset({
+    ".mp3", ".wav", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".flac", ".wma",
+    ".aif", ".aiff", ".amr", ".webm", ".mp4", ".m4v", ".mov", ".mkv", ".avi",
+    ".3gp", ".mpeg", ".mpg"
+})
+
+# CPU負荷の高い処理（音声処理・ドキュメント生成）のワーカープロセスごとの同時実行数
+# 未設定時はCPUコア数をワーカー数（WEB_CONCURRENCY）で割った値とし、全ワーカー合計でコア数程度に抑える
+CPU_BOUND_CONCURRENCY = int(os.getenv(
+    "CPU_BOUND_CONCURRENCY",
+    max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", "1"))))
+))
+_cpu_bound_semaphore = asyncio.Semaphore(CPU_BOUND_CONCURRENCY)
+
+async def run_cpu_bound(func, *args):
+    """
+    CPU負荷の高い処理を同時実行数を制限してスレッドで実行
+
+    Args:
+        func: 実行する関数
+        *args: 関数に渡す引数
+
+    Returns:
+        関数の戻り値
+    """
+    async with _cpu_bound_semaphore:
+        return await asyncio.to_thread(func, *args)
+
+# CORS設定（許可するオリジンはカンマ区切りで環境変数から指定、未設定時は同一オリジンのみ）
+CORS_ORIGINS = [
+    origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # 本番環境では特定のドメインに制限
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,  # プリフライト結果をブラウザに24時間キャッシュさせる
 )
 
+# レスポンス圧縮設定（docx/pdfは圧縮済みのため対象外）
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """指定したパスを除外してgzip圧縮するミドルウェア"""
+
+    def __init__(self, app, exclude_paths=(), **kwargs):
+        super().__init__(app, **kwargs)
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    exclude_paths=("/api/export",),
+    minimum_size=1024,
+    compresslevel=5,
+)
+
+# ヘルスチェック（頻繁に呼ばれるため、他のミドルウェアやルーティングを通さず固定のレスポンスを返す）
+HEALTH_RESPONSE_BODY = json.dumps(
+    {"status": "healthy", "service": "議事録自動生成システム"}, ensure_ascii=False
+).encode("utf-8")
+HEALTH_RESPONSE_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(HEALTH_RESPONSE_BODY)).encode("ascii")),
+]
+
+class HealthCheckMiddleware:
+    """/healthへのリクエストに最外周で応答するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/health":
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": HEALTH_RESPONSE_HEADERS,
+            })
+            await send({"type": "http.response.body", "body": HEALTH_RESPONSE_BODY})
+            return
+        await self.app(scope, receive, send)
+
+# 最後に追加したミドルウェアが最外周になるため、CORS・GZipより後に追加する
+app.add_middleware(HealthCheckMiddleware)
+
 # セキュリティ
 security = HTTPBearer()
 
 # サービスの初期化
-audio_processor = AudioProcessor()
-gemini_service = GeminiService()
 auth_service = AuthService()
-doc_generator = DocumentGenerator()
 
 # リクエスト/レスポンスモデル
 class LoginRequest(BaseModel):
@@ -82,62 +180,100 @@ class ExportRequest(BaseModel):
     metadata: MetadataInput
     format: str  # "word" or "pdf"
 
+# 認証失敗時のエラーメッセージ
+TOKEN_EXPIRED_DETAIL = "トークンの有効期限が切れています"
+INVALID_TOKEN_DETAIL = "無効なトークンです"
+
 # 認証用のデコレータ
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """JWTトークンから現在のユーザーを取得"""
     token = credentials.credentials
     try:
-        payload = jwt.decode(
-            token, 
-            os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production"),
-            algorithms=["HS256"]
-        )
-        username = payload.get("sub")
-        if username is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="無効な認証トークンです"
-            )
-        return username
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="トークンの有効期限が切れています"
-        )
-    except jwt.InvalidTokenError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="無効なトークンです"
-        )
+        # subクレームの存在はdecode_tokenで検証済み
+        return auth_service.decode_token(token)["sub"]
+    except jwt.PyJWTError as e:
+        detail = TOKEN_EXPIRED_DETAIL if isinstance(e, jwt.ExpiredSignatureError) else INVALID_TOKEN_DETAIL
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+# 静的ファイルの配信（起動時に一度だけ読み込んでメモリに保持）
+STATIC_FILES = ("index.html", "dashboard.html", "app.js")
+_static_cache = {}  # ファイル名 -> (内容, ETag)
+
+def load_static_files():
+    """配信する静的ファイルを読み込み、ETagと合わせてキャッシュ"""
+    for filename in STATIC_FILES:
+        try:
+            with open(filename, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            logger.warning(f"静的ファイルが見つかりません: {filename}")
+            continue
+        # gzip圧縮の有無で本文のバイト列が変わっても同じ値を返すため弱いETagとする
+        etag = 'W/"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+        _static_cache[filename] = (content, etag)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-MatchヘッダーとETagを弱い比較で照合
+
+    Args:
+        if_none_match: If-None-Matchヘッダーの値
+        etag: 比較するETag
+
+    Returns:
+        いずれかのタグが一致する（または"*"）場合True
+    """
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque_tag:
+            return True
+    return False
+
+def static_response(request: Request, entry: tuple, media_type: str) -> Response:
+    """
+    キャッシュ済みの静的ファイルを返す（ETagが一致する場合は304）
+
+    Args:
+        request: リクエスト
+        entry: (内容, ETag)
+        media_type: Content-Type
+
+    Returns:
+        レスポンス
+    """
+    content, etag = entry
+    # ブラウザには毎回ETagで再検証させ、変更がなければ本文を送らない
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
 
-# 静的ファイルの配信（HTMLファイル）
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
+async def read_root(request: Request):
     """ルートパスでログインページを表示"""
-    try:
-        with open("index.html", "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
+    entry = _static_cache.get("index.html")
+    if entry is None:
         return HTMLResponse(content="<h1>Welcome to 議事録自動生成システム</h1><p>index.htmlが見つかりません</p>", status_code=404)
+    return static_response(request, entry, "text/html; charset=utf-8")
 
 @app.get("/dashboard.html", response_class=HTMLResponse)
-async def read_dashboard():
+async def read_dashboard(request: Request):
     """ダッシュボードページを表示"""
-    try:
-        with open("dashboard.html", "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
+    entry = _static_cache.get("dashboard.html")
+    if entry is None:
         return HTMLResponse(content="<h1>Dashboard not found</h1>", status_code=404)
+    return static_response(request, entry, "text/html; charset=utf-8")
 
 @app.get("/app.js")
-async def read_app_js():
+async def read_app_js(request: Request):
     """JavaScriptファイルを配信"""
-    return FileResponse("app.js", media_type="application/javascript")
-
-@app.get("/health")
-async def health_check():
-    """ヘルスチェック用エンドポイント"""
-    return {"status": "healthy", "service": "議事録自動生成システム"}
+    entry = _static_cache.get("app.js")
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="app.jsが見つかりません")
+    return static_response(request, entry, "application/javascript")
 
 @app.post("/api/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
@@ -171,7 +307,8 @@ async def upload_audio(
     creator: str = Form(...),
     customer_name: str = Form(...),
     meeting_place: str = Form(...),
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    gemini_service: GeminiService = Depends(get_gemini_service)
 ):
     """
     音声ファイルをアップロードして議事録を生成
@@ -182,68 +319,54 @@ async def upload_audio(
         # 動的タイトルの生成
         dynamic_title = f"{created_date}_{creator}_{customer_name}_{meeting_place}_議事録"
 
-        # 変数の初期化
-        temp_file_path = None
-        processed_files = []
-
-        # 一時ファイルに保存
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        try:
-            # 音声ファイルの処理（圧縮・分割）
+        # アップロードファイル・処理済みファイルはAudioProcessorでまとめて管理し、終了時に削除
+        async with AudioProcessor() as audio_processor:
+            # 一時ファイルに保存（全体をメモリに載せずにチャンク単位で書き込む）
+            # 既知の拡張子のみサフィックスに使用（任意の文字列をファイル名に含めない）
+            suffix = os.path.splitext(file.filename or "")[1].lower()
+            if suffix not in ALLOWED_AUDIO_SUFFIXES:
+                suffix = ""
+            fd, temp_file_path = tempfile.mkstemp(suffix=suffix)
+            audio_processor.temp_files.append(temp_file_path)
+            with os.fdopen(fd, "wb") as temp_file:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    temp_file.write(chunk)
+
+            # 音声ファイルの処理（圧縮・分割）はCPU負荷が高いためスレッドで実行
             logger.info("音声ファイルの処理を開始")
-            processed_files = audio_processor.process_audio(temp_file_path)
-            
+            processed_files = await run_cpu_bound(audio_processor.process_audio, temp_file_path)
+
             # Gemini APIで各セグメントを並列解析
             logger.info(f"{len(processed_files)} 個のセグメントをGeminiで並列解析開始")
 
             # 並列処理でGemini APIを呼び出し
-            tasks = [gemini_service.analyze_audio(audio_file) for audio_file in processed_files]
-            results = await asyncio.gather(*tasks)
+            results = await gemini_service.analyze_segments(processed_files)
 
             # 結果を集約
             all_summaries = [result["summary"] for result in results]
-            all_confirmations = []
+            # 確認事項は出現順を保ったまま1パスで重複を除去
+            seen_confirmations = set()
+            unique_confirmations = []
             for result in results:
-                all_confirmations.extend(result["confirmation_items"])
+                for item in result["confirmation_items"]:
+                    if item not in seen_confirmations:
+                        seen_confirmations.add(item)
+                        unique_confirmations.append(item)
 
             logger.info(f"並列解析完了: {len(results)} セグメント")
-            
+
             # 複数のセグメントがある場合は統合
             if len(all_summaries) > 1:
                 final_summary = await gemini_service.merge_summaries(all_summaries)
             else:
                 final_summary = all_summaries[0]
-            
-            # 重複する確認事項を除去
-            unique_confirmations = list(dict.fromkeys(all_confirmations))
-            
+
             return MinutesResponse(
                 summary=final_summary,
                 confirmation_items=unique_confirmations,
                 dynamic_title=dynamic_title
             )
-        
-        finally:
-            # 一時ファイルのクリーンアップ
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    logger.debug(f"一時ファイル削除: {temp_file_path}")
-                except Exception as e:
-                    logger.warning(f"一時ファイル削除エラー: {temp_file_path} - {str(e)}")
-
-            for processed_file in processed_files:
-                if os.path.exists(processed_file):
-                    try:
-                        os.unlink(processed_file)
-                        logger.debug(f"処理済みファイル削除: {processed_file}")
-                    except Exception as e:
-                        logger.warning(f"処理済みファイル削除エラー: {processed_file} - {str(e)}")
-    
+
     except Exception as e:
         logger.error(f"音声処理エラー: {str(e)}")
         raise HTTPException(
@@ -254,7 +377,8 @@ async def upload_audio(
 @app.post("/api/export")
 async def export_minutes(
     request: ExportRequest,
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    doc_generator: DocumentGenerator = Depends(get_document_generator)
 ):
     """
     議事録をWord/PDF形式でエクスポート
@@ -263,25 +387,30 @@ async def export_minutes(
         logger.info(f"ユーザー {current_user} が {request.format} 形式でエクスポート")
         
         # 最終的な議事録テキストを作成（選択された確認事項を含む）
-        final_text = request.summary
+        parts = [request.summary]
         if request.selected_items:
-            final_text += "\n\n【💡確認事項】\n"
-            for item in request.selected_items:
-                final_text += f"• {item}\n"
+            parts.append("\n\n【💡確認事項】\n")
+            parts.extend(f"• {item}\n" for item in request.selected_items)
+        final_text = "".join(parts)
         
-        # ドキュメント生成
+        # メタデータは文字列フィールドのみのため、model_dumpを介さず属性辞書をコピー
+        metadata = request.metadata.__dict__.copy()
+
+        # ドキュメント生成（CPU負荷が高いためスレッドで実行）
         if request.format.lower() == "word":
-            output_path = doc_generator.generate_word(
+            output = await run_cpu_bound(
+                doc_generator.generate_word,
                 final_text, 
-                request.metadata.model_dump()
+                metadata
             )
             media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
             filename = f"{request.metadata.created_date}_{request.metadata.customer_name}_議事録.docx"
         
         elif request.format.lower() == "pdf":
-            output_path = doc_generator.generate_pdf(
+            output = await run_cpu_bound(
+                doc_generator.generate_pdf,
                 final_text,
-                request.metadata.model_dump()
+                metadata
             )
             media_type = "application/pdf"
             filename = f"{request.metadata.created_date}_{request.metadata.customer_name}_議事録.pdf"
@@ -292,10 +421,10 @@ async def export_minutes(
                 detail="サポートされていないフォーマットです"
             )
         
-        return FileResponse(
-            path=output_path,
+        return Response(
+            content=output,
             media_type=media_type,
-            filename=filename
+            headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
         )
     
     except Exception as e:
@@ -307,4 +436,22 @@ async def export_minutes(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+
+    # ワーカー数（未設定時はCPUコア数、最低2）
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", max(2, os.cpu_count() or 2))))
+    # ワーカープロセスがCPU_BOUND_CONCURRENCYの既定値を計算できるよう環境変数に反映
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    # uvloop・httptoolsはインストールされていれば"auto"で自動的に使用される
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8080,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        # 同時接続数の上限（超過分は503で即時に返し、一時ファイルの滞留を防ぐ）
+        limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY", "64")),
+        backlog=256,
+        timeout_keep_alive=30
+    )
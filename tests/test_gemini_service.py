@@ -0,0 +1,29 @@
+"""
+GeminiServiceの確認事項抽出のテスト
+"""
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from gemini_service import GeminiService
+
+
+@pytest.fixture
+def service():
+    """APIキー不要のため__init__を通さずに作成"""
+    return GeminiService.__new__(GeminiService)
+
+
+def test_extract_confirmation_items_strips_bullets(service):
+    text = "要約\n【💡確認事項】\n・項目A\n- 項目B\n1. 項目C\nなし\n## 次のセクション\n・対象外"
+    assert service._extract_confirmation_items(text) == ["項目A", "項目B", "項目C"]
+
+
+def test_extract_confirmation_items_strips_unicode_whitespace(service):
+    text = "【💡確認事項】\n　・全角インデント項目\n・ 項目B　\r\n・項目C\r\n"
+    assert service._extract_confirmation_items(text) == ["全角インデント項目", "項目B", "項目C"]
+
+
+def test_extract_confirmation_items_skips_bare_markers(service):
+    text = "【💡確認事項】\n・\n・ \n- \n•\n・項目A\n"
+    assert service._extract_confirmation_items(text) == ["項目A"]